@@ -6,12 +6,24 @@ load_dotenv()  # Загружает .env
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()]
 CRYPTOBOT_API_TOKEN = os.getenv("CRYPTOBOT_API_TOKEN")
+CRYPTO_API_BASE = os.getenv("CRYPTO_API_BASE", "https://pay.crypt.bot/api")
 CHANNEL_ID = int(os.getenv("CHANNEL_ID")) if os.getenv("CHANNEL_ID") else 0
 CHANNEL_USERNAME = os.getenv("CHANNEL_USERNAME")
+# Сколько месяцев хранить сжатые архивы продаж (0 — хранить всегда)
+SALES_RETENTION_MONTHS = int(os.getenv("SALES_RETENTION_MONTHS", "24"))
+# Строка-разделитель товаров в загружаемых .txt; пусто — один файл = один товар
+INVENTORY_DELIMITER = os.getenv("INVENTORY_DELIMITER", "").strip()
+# Максимальная сумма одного пополнения, $
+MAX_TOPUP_AMOUNT = int(os.getenv("MAX_TOPUP_AMOUNT", "10000"))
+# Валюты CryptoBot, доступные для пополнения
+TOPUP_ASSETS = [x.strip().upper() for x in os.getenv("TOPUP_ASSETS", "USDT,TON,BTC,ETH,LTC,TRX").split(",") if x.strip()]
 
-# Для отладки
-print("BOT_TOKEN:", BOT_TOKEN)
-print("ADMIN_IDS:", ADMIN_IDS)
-print("CRYPTOBOT_API_TOKEN:", CRYPTOBOT_API_TOKEN)
-print("CHANNEL_ID:", CHANNEL_ID)
-print("CHANNEL_USERNAME:", CHANNEL_USERNAME)
\ No newline at end of file
+# Логирование: общий уровень и уровни по модулям ("payments=DEBUG,aiogram=WARNING")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = {
+    name.strip(): level.strip().upper()
+    for name, _, level in (item.partition("=") for item in os.getenv("LOG_LEVELS", "").split(","))
+    if name.strip() and level.strip()
+}
+# Доля событий горячего пути (проверки подписки, отказы троттлинга), попадающих в лог
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.05"))
@@ -0,0 +1,255 @@
+"""Local stand-in for the Crypto Pay API, used by soak.py.
+
+Implements createInvoice, getInvoices, deleteInvoice and getExchangeRates, plus
+invoice_paid webhook pushes. Latency, error rate and payment timing are configurable.
+Random decisions are seeded per request (method, parameters and how many times the
+same request was made) and per invoice payload, so they do not depend on the order
+in which concurrent clients reach the stand-in. Outcomes that hinge on wall-clock
+timing, such as whether an invoice is paid before it is superseded, can still differ
+slightly between runs.
+"""
+import json
+import time
+import heapq
+import hmac
+import random
+import hashlib
+import threading
+import urllib.request
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_RATES = {"USDT": "1", "USDC": "1", "TON": "2.5", "BTC": "60000", "ETH": "3000", "LTC": "80", "TRX": "0.12"}
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+class CryptoPayStub:
+    """Crypto Pay API stand-in running on 127.0.0.1 in a background thread"""
+
+    def __init__(self, token: str = "stub-token", latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, pay_rate: float = 0.8, pay_delay: Tuple[float, float] = (0.5, 3.0),
+                 webhook_url: Optional[str] = None, rates: Optional[Dict[str, str]] = None, seed: int = 0):
+        self.token = token
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.pay_rate = pay_rate
+        self.pay_delay = pay_delay
+        self.webhook_url = webhook_url
+        self.rates = rates or DEFAULT_RATES
+        self.seed = seed
+        self.lock = threading.Lock()
+        # Сколько раз пришёл каждый запрос и создан инвойс с каждым payload: от этого зависят
+        # генераторы задержек, ошибок и оплаты, а не от порядка потоков
+        self._requests: Counter = Counter()
+        self._payloads: Counter = Counter()
+        self.invoices: Dict[int, Dict[str, Any]] = {}
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.webhooks = Counter()
+        # Попытки удалить уже не активный инвойс, по его статусу
+        self.refused_deletes: Counter = Counter()
+        # (when, invoice_id, new status)
+        self._events: List[Tuple[float, int, str]] = []
+        self._next_id = 1
+        self._stopped = threading.Event()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/api"
+
+    def start(self) -> "CryptoPayStub":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._clock, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count(self, status: str) -> int:
+        with self.lock:
+            return sum(1 for inv in self.invoices.values() if inv["status"] == status)
+
+    # ---------- время: оплата и истечение инвойсов ----------
+
+    def _clock(self) -> None:
+        while not self._stopped.wait(0.02):
+            now = time.time()
+            paid = []
+            with self.lock:
+                while self._events and self._events[0][0] <= now:
+                    when, inv_id, status = heapq.heappop(self._events)
+                    invoice = self.invoices.get(inv_id)
+                    if invoice is None or invoice["status"] != "active":
+                        continue
+                    invoice["status"] = status
+                    if status == "paid":
+                        invoice["paid_at"] = _iso(when)
+                        invoice["_paid_ts"] = when
+                        paid.append(dict(invoice))
+            for invoice in paid:
+                self._push_webhook(invoice)
+
+    def _push_webhook(self, invoice: Dict[str, Any]) -> None:
+        if not self.webhook_url:
+            return
+        update = {
+            "update_id": invoice["invoice_id"],
+            "update_type": "invoice_paid",
+            "request_date": _iso(time.time()),
+            "payload": self._public(invoice),
+        }
+        body = json.dumps(update).encode("utf-8")
+        # Подпись как у Crypto Pay: HMAC-SHA256 тела с ключом SHA256(token)
+        secret = hashlib.sha256(self.token.encode("utf-8")).digest()
+        signature = hmac.new(secret, body, hashlib.sha256).hexdigest()
+        request = urllib.request.Request(self.webhook_url, data=body, headers={
+            "Content-Type": "application/json",
+            "crypto-pay-api-signature": signature,
+        })
+        try:
+            urllib.request.urlopen(request, timeout=5).close()
+            self.webhooks["sent"] += 1
+        except Exception:
+            self.webhooks["failed"] += 1
+
+    # ---------- методы API ----------
+
+    @staticmethod
+    def _public(invoice: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in invoice.items() if not k.startswith("_")}
+
+    def _create_invoice(self, params: Dict[str, Any]) -> Tuple[bool, Any]:
+        try:
+            amount = float(params["amount"])
+        except (KeyError, TypeError, ValueError):
+            return False, {"code": 400, "name": "AMOUNT_INVALID"}
+        if amount <= 0 or params.get("asset") not in self.rates:
+            return False, {"code": 400, "name": "PARAMS_INVALID"}
+        now = time.time()
+        with self.lock:
+            inv_id = self._next_id
+            self._next_id += 1
+            invoice = {
+                "invoice_id": inv_id,
+                "hash": f"IV{inv_id}",
+                "status": "active",
+                "asset": params["asset"],
+                "amount": str(params["amount"]),
+                "pay_url": f"https://t.me/CryptoBot?start=IV{inv_id}",
+                "description": params.get("description", ""),
+                "payload": params.get("payload", ""),
+                "created_at": _iso(now),
+            }
+            self.invoices[inv_id] = invoice
+            # Судьба инвойса зависит от seed и payload, а не от номера, выданного в порядке запросов
+            payload_key = f"{invoice['payload']}:{invoice['asset']}"
+            self._payloads[payload_key] += 1
+            rng = random.Random(f"{self.seed}:{payload_key}:{self._payloads[payload_key]}")
+            if rng.random() < self.pay_rate:
+                heapq.heappush(self._events, (now + rng.uniform(*self.pay_delay), inv_id, "paid"))
+            if params.get("expires_in"):
+                heapq.heappush(self._events, (now + float(params["expires_in"]), inv_id, "expired"))
+        return True, self._public(invoice)
+
+    def _get_invoices(self, params: Dict[str, Any]) -> Tuple[bool, Any]:
+        count = min(int(params.get("count") or 100), 1000)
+        offset = int(params.get("offset") or 0)
+        with self.lock:
+            if params.get("invoice_ids"):
+                ids = [int(i) for i in str(params["invoice_ids"]).split(",") if i]
+                items = [self.invoices[i] for i in ids if i in self.invoices]
+            else:
+                items = list(self.invoices.values())
+            # Удалённые инвойсы API больше не возвращает
+            items = [inv for inv in items if inv["status"] != "deleted"]
+            if params.get("status"):
+                items = [inv for inv in items if inv["status"] == params["status"]]
+            # Как и настоящий API: новые первыми, не больше count за раз
+            items.sort(key=lambda inv: inv["invoice_id"], reverse=True)
+            items = [self._public(inv) for inv in items[offset:offset + count]]
+        return True, {"items": items}
+
+    def _delete_invoice(self, params: Dict[str, Any]) -> Tuple[bool, Any]:
+        with self.lock:
+            invoice = self.invoices.get(int(params.get("invoice_id") or 0))
+            if invoice is None or invoice["status"] != "active":
+                self.refused_deletes[invoice["status"] if invoice else "unknown"] += 1
+                return False, {"code": 400, "name": "INVOICE_NOT_FOUND"}
+            invoice["status"] = "deleted"
+        return True, True
+
+    def _get_exchange_rates(self, params: Dict[str, Any]) -> Tuple[bool, Any]:
+        return True, [
+            {"is_valid": True, "is_crypto": True, "is_fiat": False, "source": asset, "target": "USD", "rate": rate}
+            for asset, rate in self.rates.items()
+        ]
+
+    def _dispatch(self, method: str, params: Dict[str, Any], token: Optional[str]) -> Tuple[int, Dict[str, Any]]:
+        methods = {
+            "createInvoice": self._create_invoice,
+            "getInvoices": self._get_invoices,
+            "deleteInvoice": self._delete_invoice,
+            "getExchangeRates": self._get_exchange_rates,
+        }
+        request_key = f"{method}:{json.dumps(params, sort_keys=True)}"
+        with self.lock:
+            self.calls[method] += 1
+            self._requests[request_key] += 1
+            rng = random.Random(f"{self.seed}:{request_key}:{self._requests[request_key]}")
+        delay = self.latency + rng.uniform(-self.jitter, self.jitter)
+        failed = rng.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if token != self.token:
+            return 401, {"ok": False, "error": {"code": 401, "name": "UNAUTHORIZED"}}
+        if method not in methods:
+            return 405, {"ok": False, "error": {"code": 405, "name": "METHOD_NOT_FOUND"}}
+        if failed:
+            with self.lock:
+                self.errors[method] += 1
+            return 500, {"ok": False, "error": {"code": 500, "name": "INTERNAL_ERROR"}}
+        ok, result = methods[method](params)
+        if not ok:
+            return 400, {"ok": False, "error": result}
+        return 200, {"ok": True, "result": result}
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, params: Dict[str, Any]) -> None:
+                url = urlparse(self.path)
+                method = url.path.rsplit("/", 1)[-1]
+                params.update({k: v[-1] for k, v in parse_qs(url.query).items()})
+                status, body = stub._dispatch(method, params, self.headers.get("Crypto-Pay-API-Token"))
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self) -> None:
+                self._reply({})
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    params = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError:
+                    params = {}
+                self._reply(params if isinstance(params, dict) else {})
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        return Handler
@@ -1,12 +1,16 @@
 import os
+import re
+import gzip
 import json
-from typing import Dict, Any, Optional, List, Tuple
-from datetime import datetime, timezone
+import heapq
+from typing import Dict, Any, Iterable, Optional, List, Set, Tuple
+from datetime import datetime, timedelta, timezone
 from collections import defaultdict
-from config import ADMIN_IDS
+from config import ADMIN_IDS, SALES_RETENTION_MONTHS
 
 # Работа с пользователями
 USER_FILE = "users.json"
+# Устаревший единый файл продаж, переносится в партиции при первом обращении
 SALES_FILE = "sales.json"
 
 def load_users() -> Dict[str, Any]:
@@ -57,24 +61,170 @@ def add_user(user_id: int, username: str = "") -> None:
     save_users(users)
 
 # -------------------- Продажи и статистика --------------------
+#
+# Продажи разбиты по месяцам (UTC). Текущий месяц лежит "горячей" партицией
+# в sales/YYYY-MM.json. Закрытые месяцы сжимаются в sales/archive/YYYY-MM.json.gz,
+# а их агрегаты попадают в sales/rollups.json. Статистика читает только
+# горячую партицию и роллапы, поэтому не зависит от длины истории.
 
-def _ensure_sales_file() -> None:
-    if not os.path.exists(SALES_FILE):
-        with open(SALES_FILE, "w", encoding="utf-8") as f:
-            json.dump([], f)
+SALES_DIR = "sales"
+SALES_ARCHIVE_DIR = os.path.join(SALES_DIR, "archive")
+SALES_ROLLUPS_FILE = os.path.join(SALES_DIR, "rollups.json")
+# Суммы покупок по пользователям за текущие день/неделю/месяц и за всё время
+SALES_LEADERBOARD_FILE = os.path.join(SALES_DIR, "leaderboard.json")
+_HOT_PARTITION_RE = re.compile(r"^(\d{4}-\d{2})\.json$")
 
-def load_sales() -> List[Dict[str, Any]]:
-    """Загружает список продаж"""
+# Месяц, для которого уже выполнена ротация партиций
+_rotated_month: Optional[str] = None
+# Кэш лидерборда в памяти, обновляется в add_sale
+_leaderboard: Optional[Dict[str, Any]] = None
+
+def _admin_set() -> Set[int]:
+    return {int(x) for x in ADMIN_IDS}
+
+def _month_key(dt: datetime) -> str:
+    return dt.strftime("%Y-%m")
+
+def _sale_month(sale: Dict[str, Any], default: str) -> str:
     try:
-        with open(SALES_FILE, "r", encoding="utf-8") as f:
+        return _month_key(datetime.fromisoformat(sale.get("ts", "")))
+    except Exception:
+        return default
+
+def _hot_path(month: str) -> str:
+    return os.path.join(SALES_DIR, f"{month}.json")
+
+def _archive_path(month: str) -> str:
+    return os.path.join(SALES_ARCHIVE_DIR, f"{month}.json.gz")
+
+def _read_json(path: str, default: Any) -> Any:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     except (json.JSONDecodeError, FileNotFoundError):
-        _ensure_sales_file()
-        return []
+        return default
+
+def _write_json_atomic(path: str, data: Any) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _empty_rollups() -> Dict[str, Any]:
+    return {"months": {}, "totals": {"revenue": 0, "orders": 0, "spent_by_user": {}}}
+
+def load_rollups() -> Dict[str, Any]:
+    """Загружает агрегаты по закрытым месяцам"""
+    rollups = _read_json(SALES_ROLLUPS_FILE, None)
+    if not isinstance(rollups, dict):
+        return _empty_rollups()
+    return rollups
+
+def _build_month_rollup(sales: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[int, int]]:
+    """Считает агрегаты месяца: выручку, заказы и покупателей (всего и по папкам)"""
+    admin_set = _admin_set()
+    revenue = 0
+    orders = 0
+    spent_by_user: Dict[int, int] = defaultdict(int)
+    folders: Dict[str, Dict[str, Any]] = {}
+    for s in sales:
+        uid = int(s.get("user_id", 0))
+        if uid in admin_set:
+            continue
+        price = int(s.get("total_price", 0))
+        revenue += price
+        orders += 1
+        spent_by_user[uid] += price
+        folder = folders.setdefault(s.get("folder", ""), {"revenue": 0, "orders": 0, "buyers": set()})
+        folder["revenue"] += price
+        folder["orders"] += 1
+        folder["buyers"].add(uid)
+    rollup = {
+        "revenue": revenue,
+        "orders": orders,
+        "buyers": len(spent_by_user),
+        "folders": {
+            name: {"revenue": f["revenue"], "orders": f["orders"], "buyers": len(f["buyers"])}
+            for name, f in folders.items()
+        },
+    }
+    return rollup, spent_by_user
+
+def _compact_month(month: str) -> None:
+    """Сжимает закрытую партицию в архив и добавляет её агрегаты в роллапы"""
+    hot_path = _hot_path(month)
+    rollups = load_rollups()
+    # Запись роллапов — точка фиксации: если месяц уже учтён, партиция осталась
+    # после прерванной компактации и её достаточно удалить
+    if month not in rollups["months"]:
+        sales = _read_json(hot_path, [])
+        archive_path = _archive_path(month)
+        tmp_path = f"{archive_path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(sales, f, ensure_ascii=False)
+        os.replace(tmp_path, archive_path)
+
+        rollup, spent_by_user = _build_month_rollup(sales)
+        rollups["months"][month] = rollup
+        totals = rollups["totals"]
+        totals["revenue"] += rollup["revenue"]
+        totals["orders"] += rollup["orders"]
+        for uid, spent in spent_by_user.items():
+            key = str(uid)
+            totals["spent_by_user"][key] = totals["spent_by_user"].get(key, 0) + spent
+        _write_json_atomic(SALES_ROLLUPS_FILE, rollups)
+    os.remove(hot_path)
+
+def _migrate_legacy_sales(current_month: str) -> None:
+    """Раскладывает старый sales.json по месячным партициям"""
+    migrating_path = f"{SALES_FILE}.migrating"
+    # Сначала переименовываем: если перенос прервётся, при следующем запуске он
+    # повторится из .migrating, а партиции перезапишутся, а не дополнятся повторно
+    if os.path.exists(SALES_FILE):
+        os.replace(SALES_FILE, migrating_path)
+    if not os.path.exists(migrating_path):
+        return
+    by_month: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for s in _read_json(migrating_path, []):
+        by_month[_sale_month(s, current_month)].append(s)
+    for month, sales in by_month.items():
+        _write_json_atomic(_hot_path(month), sales)
+    os.replace(migrating_path, f"{SALES_FILE}.migrated")
+
+def _apply_retention(current_month: str) -> None:
+    """Удаляет архивы старше SALES_RETENTION_MONTHS (роллапы сохраняются)"""
+    if SALES_RETENTION_MONTHS <= 0:
+        return
+    year, month = (int(x) for x in current_month.split("-"))
+    index = year * 12 + month - 1 - SALES_RETENTION_MONTHS
+    cutoff = f"{index // 12:04d}-{index % 12 + 1:02d}"
+    for name in os.listdir(SALES_ARCHIVE_DIR):
+        if name.endswith(".json.gz") and name[:-len(".json.gz")] < cutoff:
+            os.remove(os.path.join(SALES_ARCHIVE_DIR, name))
+
+def _rotate_sales() -> str:
+    """Закрывает прошедшие месяцы и возвращает ключ текущей партиции"""
+    global _rotated_month
+    month = _month_key(datetime.now(timezone.utc))
+    if _rotated_month == month:
+        return month
+    os.makedirs(SALES_ARCHIVE_DIR, exist_ok=True)
+    _migrate_legacy_sales(month)
+    for name in sorted(os.listdir(SALES_DIR)):
+        match = _HOT_PARTITION_RE.match(name)
+        if match and match.group(1) < month:
+            _compact_month(match.group(1))
+    _apply_retention(month)
+    _rotated_month = month
+    return month
+
+def load_sales() -> List[Dict[str, Any]]:
+    """Загружает продажи текущего месяца (горячая партиция)"""
+    return _read_json(_hot_path(_rotate_sales()), [])
 
 def save_sales(sales: List[Dict[str, Any]]) -> None:
-    with open(SALES_FILE, "w", encoding="utf-8") as f:
-        json.dump(sales, f, indent=4, ensure_ascii=False)
+    """Сохраняет горячую партицию"""
+    _write_json_atomic(_hot_path(_rotate_sales()), sales)
 
 def add_sale(user_id: int, total_price: int, quantity: int, folder: str, item_type: str) -> None:
     """Добавляет запись о продаже"""
@@ -84,73 +234,139 @@ def add_sale(user_id: int, total_price: int, quantity: int, folder: str, item_ty
             return
     except Exception:
         pass
-    sales = load_sales()
-    sales.append({
+    # Лидерборд загружаем до записи, чтобы первичная сборка не учла продажу дважды
+    board = _load_leaderboard()
+    sale = {
         "ts": datetime.now(timezone.utc).isoformat(),
         "user_id": int(user_id),
         "total_price": int(total_price),
         "quantity": int(quantity),
         "folder": folder,
         "item_type": item_type,
-    })
+    }
+    sales = load_sales()
+    sales.append(sale)
     save_sales(sales)
+    _credit_leaderboard(board, sale, _period_keys(datetime.now(timezone.utc)))
+    _write_json_atomic(SALES_LEADERBOARD_FILE, board)
 
-def _is_same_day(ts_iso: str, ref: datetime) -> bool:
+# -------------------- Лидерборд покупателей --------------------
+
+LEADERBOARD_PERIODS = ("day", "week", "month", "all")
+
+def _period_keys(dt: datetime) -> Dict[str, str]:
+    iso = dt.isocalendar()
+    return {
+        "day": dt.date().isoformat(),
+        "week": f"{iso[0]}-W{iso[1]:02d}",
+        "month": _month_key(dt),
+        "all": "all",
+    }
+
+def _credit_leaderboard(board: Dict[str, Any], sale: Dict[str, Any], keys: Dict[str, str]) -> None:
+    """Добавляет продажу в те окна лидерборда, чей ключ совпадает с датой продажи"""
     try:
-        ts = datetime.fromisoformat(ts_iso)
+        sale_keys = _period_keys(datetime.fromisoformat(sale.get("ts", "")))
     except Exception:
-        return False
-    return ts.date() == ref.date()
+        return
+    uid = str(int(sale.get("user_id", 0)))
+    price = int(sale.get("total_price", 0))
+    for period, key in keys.items():
+        if sale_keys[period] == key:
+            spent = board[period]["spent"]
+            spent[uid] = spent.get(uid, 0) + price
 
-def _is_same_month(ts_iso: str, ref: datetime) -> bool:
+def _rebuild_leaderboard() -> Dict[str, Any]:
+    """Первичная сборка: роллапы + текущий месяц (+ архив прошлого месяца для начала недели)"""
+    now = datetime.now(timezone.utc)
+    keys = _period_keys(now)
+    # load_sales первым: он закрывает прошедшие месяцы и обновляет роллапы
+    current = load_sales()
+    board = {period: {"key": key, "spent": {}} for period, key in keys.items()}
+    board["all"]["spent"] = {uid: int(v) for uid, v in load_rollups()["totals"]["spent_by_user"].items()}
+    week_month = _month_key(now - timedelta(days=now.weekday()))
+    if week_month != keys["month"] and os.path.exists(_archive_path(week_month)):
+        with gzip.open(_archive_path(week_month), "rt", encoding="utf-8") as f:
+            for sale in json.load(f):
+                _credit_leaderboard(board, sale, {"week": keys["week"]})
+    for sale in current:
+        _credit_leaderboard(board, sale, keys)
+    return board
+
+def _load_leaderboard() -> Dict[str, Any]:
+    global _leaderboard
+    if _leaderboard is None:
+        board = _read_json(SALES_LEADERBOARD_FILE, None)
+        if not isinstance(board, dict):
+            board = _rebuild_leaderboard()
+            _write_json_atomic(SALES_LEADERBOARD_FILE, board)
+        _leaderboard = board
+    # Наступил новый день/неделя/месяц — окно начинается заново
+    for period, key in _period_keys(datetime.now(timezone.utc)).items():
+        window = _leaderboard.setdefault(period, {"key": key, "spent": {}})
+        if window["key"] != key:
+            window["key"] = key
+            window["spent"] = {}
+    return _leaderboard
+
+def _is_same_day(ts_iso: str, ref: datetime) -> bool:
     try:
         ts = datetime.fromisoformat(ts_iso)
     except Exception:
         return False
-    return ts.year == ref.year and ts.month == ref.month
+    return ts.date() == ref.date()
+
+def _hot_sales_without_admins() -> List[Dict[str, Any]]:
+    admin_set = _admin_set()
+    return [s for s in load_sales() if int(s.get("user_id", 0)) not in admin_set]
 
 def get_unique_buyers_count() -> int:
-    sales = load_sales()
-    admin_set = {int(x) for x in ADMIN_IDS}
-    return len({str(s.get("user_id")) for s in sales if int(s.get("user_id", 0)) not in admin_set})
+    admin_set = _admin_set()
+    # Сначала горячая партиция: load_sales закрывает прошедшие месяцы и обновляет роллапы
+    hot = load_sales()
+    buyers = {int(uid) for uid in load_rollups()["totals"]["spent_by_user"]}
+    buyers.update(int(s.get("user_id", 0)) for s in hot)
+    return len(buyers - admin_set)
 
 def get_sales_sum_day() -> int:
-    sales = load_sales()
     now = datetime.now(timezone.utc)
-    admin_set = {int(x) for x in ADMIN_IDS}
-    return sum(int(s.get("total_price", 0)) for s in sales if int(s.get("user_id", 0)) not in admin_set and _is_same_day(s.get("ts", ""), now))
+    return sum(int(s.get("total_price", 0)) for s in _hot_sales_without_admins() if _is_same_day(s.get("ts", ""), now))
 
 def get_sales_sum_month() -> int:
-    sales = load_sales()
-    now = datetime.now(timezone.utc)
-    admin_set = {int(x) for x in ADMIN_IDS}
-    return sum(int(s.get("total_price", 0)) for s in sales if int(s.get("user_id", 0)) not in admin_set and _is_same_month(s.get("ts", ""), now))
+    # Горячая партиция и есть текущий месяц
+    return sum(int(s.get("total_price", 0)) for s in _hot_sales_without_admins())
+
+def get_sales_sum_total() -> int:
+    """Выручка за всё время: роллапы закрытых месяцев плюс текущий месяц"""
+    month = get_sales_sum_month()
+    return load_rollups()["totals"]["revenue"] + month
 
 def get_total_orders_count() -> int:
-    admin_set = {int(x) for x in ADMIN_IDS}
-    return len([s for s in load_sales() if int(s.get("user_id", 0)) not in admin_set])
+    hot_orders = len(_hot_sales_without_admins())
+    return load_rollups()["totals"]["orders"] + hot_orders
 
 def get_avg_ticket_today() -> float:
-    sales = load_sales()
     now = datetime.now(timezone.utc)
-    admin_set = {int(x) for x in ADMIN_IDS}
-    today_sales = [int(s.get("total_price", 0)) for s in sales if int(s.get("user_id", 0)) not in admin_set and _is_same_day(s.get("ts", ""), now)]
+    today_sales = [int(s.get("total_price", 0)) for s in _hot_sales_without_admins() if _is_same_day(s.get("ts", ""), now)]
     if not today_sales:
         return 0.0
     return sum(today_sales) / len(today_sales)
 
-def get_top_buyers(limit: int = 5) -> List[Tuple[int, int]]:
-    """Возвращает список (user_id, total_spent) отсортированный по сумме, ограничение limit"""
-    sales = load_sales()
-    spent_by_user: Dict[int, int] = defaultdict(int)
-    admin_set = {int(x) for x in ADMIN_IDS}
-    for s in sales:
-        if int(s.get("user_id", 0)) in admin_set:
-            continue
-        spent_by_user[int(s.get("user_id", 0))] += int(s.get("total_price", 0))
-    items = sorted(spent_by_user.items(), key=lambda kv: kv[1], reverse=True)
-    return items[:limit]
+def get_top_buyers(limit: int = 5, period: str = "all") -> List[Tuple[int, int]]:
+    """Возвращает список (user_id, total_spent) за период (day/week/month/all), отсортированный по сумме"""
+    admin_set = _admin_set()
+    spent = _load_leaderboard()[period]["spent"]
+    return heapq.nlargest(
+        limit,
+        ((int(uid), int(v)) for uid, v in spent.items() if int(uid) not in admin_set),
+        key=lambda kv: kv[1],
+    )
 
 def get_username_by_user_id(user_id: int) -> str:
     users = load_users()
     return users.get(str(user_id), {}).get("username", "")
+
+def get_usernames(user_ids: Iterable[int]) -> Dict[int, str]:
+    """Возвращает {user_id: username} за одно чтение users.json"""
+    users = load_users()
+    return {int(uid): users.get(str(uid), {}).get("username", "") for uid in user_ids}
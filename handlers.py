@@ -1,4 +1,8 @@
 import os
+import asyncio
+import logging
+import tempfile
+import zipfile
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.types import (
     Message, FSInputFile, ReplyKeyboardMarkup, KeyboardButton,
@@ -10,7 +14,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from config import ADMIN_IDS, CHANNEL_ID, CHANNEL_USERNAME
+from config import ADMIN_IDS, CHANNEL_ID, CHANNEL_USERNAME, LOG_SAMPLE_RATE, TOPUP_ASSETS, MAX_TOPUP_AMOUNT
 from database import (
     load_users,
     save_users,
@@ -22,13 +26,18 @@ from database import (
     get_unique_buyers_count,
     get_sales_sum_day,
     get_sales_sum_month,
+    get_sales_sum_total,
     get_total_orders_count,
     get_avg_ticket_today,
     get_top_buyers,
-    get_username_by_user_id,
-    load_sales,
+    get_usernames,
 )
+from inventory import route_folder, ingest_upload
 from payments import create_crypto_invoice
+from rates import convert_usd
+from throttling import ThrottlingMiddleware
+
+logger = logging.getLogger(__name__)
 
 # FSM для админки
 class AdminStates(StatesGroup):
@@ -77,7 +86,8 @@ async def is_user_subscribed(bot: Bot, user_id: int) -> bool:
     try:
         member = await bot.get_chat_member(chat_id=chat_id, user_id=user_id)
         status = member.status
-        print(f"User {user_id} status in {chat_id}: {status}")
+        logger.info("Subscription status", extra={"user_id": user_id, "chat_id": chat_id,
+                                                  "status": status, "sample": LOG_SAMPLE_RATE})
 
         # Ensure the user hasn't left or been kicked
         if status in [ChatMemberStatus.LEFT, ChatMemberStatus.KICKED]:
@@ -94,7 +104,7 @@ async def is_user_subscribed(bot: Bot, user_id: int) -> bool:
 
         return False
     except Exception as e:
-        print(f"Error checking subscription for user {user_id}: {repr(e)}")
+        logger.warning("Error checking subscription for user %s: %r", user_id, e)
         return False
 
 async def send_main_menu(bot: Bot, user_id: int):
@@ -116,9 +126,14 @@ async def send_main_menu(bot: Bot, user_id: int):
 
 def register_handlers(dp: Dispatcher, bot: Bot):
     """Register all handlers"""
-    
+
+    # Per-user rate limits; handler class is set via flags={"throttle": ...}, default is "menu"
+    throttling = ThrottlingMiddleware()
+    dp.message.middleware(throttling)
+    dp.callback_query.middleware(throttling)
+
     # /start with subscription check
-    @dp.message(CommandStart())
+    @dp.message(CommandStart(), flags={"throttle": "start"})
     async def cmd_start(message: Message):
         user_id = message.from_user.id
         username = message.from_user.username or ""
@@ -146,7 +161,7 @@ def register_handlers(dp: Dispatcher, bot: Bot):
         await send_main_menu(bot, user_id)
 
     # Subscription check button
-    @dp.callback_query(F.data == "check_sub")
+    @dp.callback_query(F.data == "check_sub", flags={"throttle": "start"})
     async def check_subscription(callback: types.CallbackQuery):
         user_id = callback.from_user.id
         chat_id = CHANNEL_ID
@@ -154,7 +169,8 @@ def register_handlers(dp: Dispatcher, bot: Bot):
         try:
             member = await bot.get_chat_member(chat_id=chat_id, user_id=user_id)
             status = member.status
-            print(f"User {user_id} status in {chat_id}: {status}")
+            logger.info("Subscription status", extra={"user_id": user_id, "chat_id": chat_id,
+                                                      "status": status, "sample": LOG_SAMPLE_RATE})
 
             if status not in [ChatMemberStatus.LEFT, ChatMemberStatus.KICKED]:
                 await callback.message.edit_text(
@@ -165,7 +181,7 @@ def register_handlers(dp: Dispatcher, bot: Bot):
             else:
                 await callback.answer("❌ You are not subscribed. Please subscribe.", show_alert=True)
         except Exception as e:
-            print(f"Subscription check error: {repr(e)}")
+            logger.warning("Subscription check error: %r", e)
             await callback.answer("⚠️ Failed to check subscription. Try again later.", show_alert=True)
 
     # Admin panel
@@ -238,7 +254,7 @@ def register_handlers(dp: Dispatcher, bot: Bot):
         try:
             await bot.send_message(user_id, user_text)
         except Exception as e:
-            print(f"Error sending message to user {user_id}: {e}")
+            logger.warning("Error sending message to user %s: %s", user_id, e)
 
         await state.clear()
 
@@ -288,7 +304,7 @@ def register_handlers(dp: Dispatcher, bot: Bot):
         sales_month = get_sales_sum_month()
         orders_total = get_total_orders_count()
         avg_ticket = get_avg_ticket_today()
-        sales_all = sum(int(s.get("total_price", 0)) for s in load_sales())
+        sales_all = get_sales_sum_total()
         conversion = (unique_buyers / total_users * 100) if total_users else 0
         text = (
             "📊 Statistics:\n"
@@ -306,16 +322,22 @@ def register_handlers(dp: Dispatcher, bot: Bot):
 
     @dp.callback_query(F.data == "admin_top_buyers")
     async def admin_top_buyers(callback: types.CallbackQuery):
-        top = get_top_buyers(limit=5)
-        if not top:
+        periods = [("day", "Today"), ("week", "This week"), ("month", "This month"), ("all", "All time")]
+        tops = {period: get_top_buyers(limit=5, period=period) for period, _title in periods}
+        if not tops["all"]:
             await callback.message.answer("No purchases yet.")
             await callback.answer()
             return
+        usernames = get_usernames({uid for top in tops.values() for uid, _spent in top})
         lines = ["🏆 Top buyers:"]
-        for idx, (uid, spent) in enumerate(top, start=1):
-            uname = get_username_by_user_id(uid)
-            display = f"@{uname}" if uname else str(uid)
-            lines.append(f"{idx}. {display} — {spent}$")
+        for period, title in periods:
+            lines.append(f"\n<b>{title}</b>")
+            if not tops[period]:
+                lines.append("—")
+            for idx, (uid, spent) in enumerate(tops[period], start=1):
+                uname = usernames.get(uid, "")
+                display = f"@{uname}" if uname else str(uid)
+                lines.append(f"{idx}. {display} — {spent}$")
         await callback.message.answer("\n".join(lines))
         await callback.answer()
 
@@ -425,7 +447,7 @@ def register_handlers(dp: Dispatcher, bot: Bot):
         )
         await callback.answer()
 
-    @dp.callback_query(F.data.startswith("buy_qty:"))
+    @dp.callback_query(F.data.startswith("buy_qty:"), flags={"throttle": "purchase"})
     async def process_purchase(callback: types.CallbackQuery):
         _, folder, qty_str = callback.data.split(":")
         quantity = int(qty_str)
@@ -504,13 +526,40 @@ def register_handlers(dp: Dispatcher, bot: Bot):
         if amount <= 0:
             await message.answer("❌ Amount must be positive.")
             return
-        url = create_crypto_invoice(message.from_user.id, amount)
+        if amount > MAX_TOPUP_AMOUNT:
+            await message.answer(f"❌ Maximum top-up amount is {MAX_TOPUP_AMOUNT}$.")
+            return
+        # Показываем только валюты, для которых в кэше есть свежий курс
+        quotes = [(asset, convert_usd(amount, asset)) for asset in TOPUP_ASSETS]
+        quotes = [(asset, quote) for asset, quote in quotes if quote is not None]
+        if not quotes:
+            await message.answer("❌ Payments are temporarily unavailable. Try again later.")
+            return
+        kb = InlineKeyboardBuilder()
+        for asset, quote in quotes:
+            kb.button(text=f"{asset} · {quote}", callback_data=f"topup_asset:{amount}:{asset}")
+        kb.adjust(2)
+        await message.answer(f"Amount: {amount}$\nChoose a currency to pay with:", reply_markup=kb.as_markup())
+
+    @dp.callback_query(F.data.startswith("topup_asset:"), flags={"throttle": "invoice"})
+    async def create_topup_invoice(callback: types.CallbackQuery):
+        _, amount_str, asset = callback.data.split(":")
+        amount = int(amount_str)
+        if asset not in TOPUP_ASSETS or not 0 < amount <= MAX_TOPUP_AMOUNT:
+            await callback.answer()
+            return
+        # Запрос к CryptoBot блокирующий — выполняем вне event loop
+        url = await asyncio.to_thread(create_crypto_invoice, callback.from_user.id, amount, asset)
         if url:
             btn = InlineKeyboardButton(text="💳 Proceed to payment", url=url)
             markup = InlineKeyboardMarkup(inline_keyboard=[[btn]])
-            await message.answer(f"Amount: {amount}$\nClick the button below to pay via CryptoBot:", reply_markup=markup)
+            await callback.message.answer(
+                f"Amount: {amount}$ in {asset}\nClick the button below to pay via CryptoBot:",
+                reply_markup=markup
+            )
         else:
-            await message.answer("❌ Failed to create invoice. Try again later.")
+            await callback.message.answer("❌ Failed to create invoice. Try again later.")
+        await callback.answer()
 
     @dp.callback_query(F.data == "rules")
     async def rules(callback: types.CallbackQuery):
@@ -553,24 +602,55 @@ def register_handlers(dp: Dispatcher, bot: Bot):
         file = message.document
         filename = (file.file_name or "").lower()
 
-        if not filename.endswith(".txt"):
-            await message.answer("❌ Only .txt files are allowed.")
+        if not filename.endswith((".txt", ".zip")):
+            await message.answer("❌ Only .txt or .zip files are allowed.")
             return
 
-        # Сначала проверяем аккаунты
-        for name, cat in categories.items():
-            if cat['folder'] in filename:
-                path = f"data/{cat['folder']}/{filename}"
-                await bot.download(file=file.file_id, destination=path)
-                await message.answer(f"✅ File added to category: {name}")
-                return
-
-        # Затем проверяем прокси
-        for name, p in proxies.items():
-            if p['folder'] in filename:
-                path = f"data/{p['folder']}/{filename}"
-                await bot.download(file=file.file_id, destination=path)
-                await message.answer(f"✅ File added to category: {name}")
-                return
+        # Сначала аккаунты, затем прокси
+        folder_names = {info["folder"]: name for name, info in categories.items()}
+        folder_names.update({info["folder"]: name for name, info in proxies.items()})
+        folders = list(folder_names)
+        default_folder = route_folder(filename, folders)
+        if filename.endswith(".txt") and default_folder is None:
+            await message.answer("❌ Could not determine category from filename.")
+            return
 
-        await message.answer("❌ Could not determine category from filename.")
+        fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1], dir="data")
+        os.close(fd)
+        try:
+            await bot.download(file=file.file_id, destination=tmp_path)
+            report = await asyncio.to_thread(ingest_upload, tmp_path, filename, default_folder, folders)
+        except zipfile.BadZipFile:
+            await message.answer("❌ Archive is corrupted. Items read before the error were added.")
+            return
+        except RuntimeError:
+            # zipfile отказывается читать зашифрованные файлы без пароля
+            await message.answer("❌ Archive contains encrypted files. Items read before the error were added.")
+            return
+        except NotImplementedError:
+            await message.answer("❌ Archive uses an unsupported compression method. "
+                                 "Items read before the error were added.")
+            return
+        finally:
+            os.remove(tmp_path)
+
+        counts = report["counts"]
+        duplicates = report["duplicates"]
+        total = sum(counts.values())
+        if not total and not duplicates:
+            await message.answer("❌ No items found in the upload.")
+            return
+        elapsed = report["elapsed"]
+        rate = total / elapsed if elapsed > 0 else float(total)
+        logger.info("Inventory ingested", extra={"file": filename, "items": total, "items_per_s": round(rate),
+                                                 "duplicates": sum(duplicates.values())})
+        lines = [f"✅ Added {total} items:"]
+        for folder, count in counts.items():
+            lines.append(f"{folder_names[folder]}: {count} pcs")
+        if duplicates:
+            where = ", ".join(f"{folder_names.get(folder, folder)} {count}" for folder, count in duplicates.items())
+            lines.append(f"♻️ Duplicates rejected: {sum(duplicates.values())} (already uploaded to: {where})")
+        if report["skipped"]:
+            lines.append(f"⚠️ Skipped (unknown category): {', '.join(report['skipped'])}")
+        lines.append(f"⏱ {elapsed:.2f}s, {rate:.0f} items/s")
+        await message.answer("\n".join(lines))
@@ -0,0 +1,180 @@
+import io
+import os
+import time
+import hashlib
+import zipfile
+import threading
+from itertools import chain
+from typing import Callable, Dict, Any, Iterator, List, Optional, Set, Tuple, Union
+
+from config import INVENTORY_DELIMITER
+
+# Сколько товаров копим в памяти перед записью в data/<folder>/
+INGEST_BATCH_SIZE = 500
+
+# Индекс хешей всех когда-либо загруженных товаров (включая проданные):
+# по строке "<blake2b hex> <folder>" на товар, только дописывается
+INVENTORY_INDEX_FILE = "data/hashes.idx"
+
+_index: Optional[Dict[bytes, str]] = None
+_index_lock = threading.Lock()
+
+def route_folder(name: str, folders: List[str]) -> Optional[str]:
+    """Picks the stock folder whose name is contained in the file name"""
+    name = name.lower()
+    for folder in folders:
+        if folder in name:
+            return folder
+    return None
+
+def item_digest(content: Union[str, bytes]) -> bytes:
+    """Content hash of a stock item; raw bytes are hashed as is, so non-UTF-8 items stay distinct"""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.blake2b(content.strip(), digest_size=16).digest()
+
+def _load_index(folders: List[str]) -> Dict[bytes, str]:
+    """Loads the hash index into memory once; on first run builds it from current stock"""
+    global _index
+    if _index is not None:
+        return _index
+    index: Dict[bytes, str] = {}
+    if os.path.exists(INVENTORY_INDEX_FILE):
+        with open(INVENTORY_INDEX_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2:
+                    index[bytes.fromhex(parts[0])] = parts[1]
+    else:
+        with open(INVENTORY_INDEX_FILE, "w", encoding="utf-8") as out:
+            for folder in folders:
+                for name in os.listdir(f"data/{folder}"):
+                    digest = item_digest(_read_file(f"data/{folder}/{name}"))
+                    if digest not in index:
+                        index[digest] = folder
+                        out.write(f"{digest.hex()} {folder}\n")
+    _index = index
+    return index
+
+def iter_items(stream: Iterator[str]) -> Iterator[str]:
+    """Splits a text stream into items by delimiter lines, without reading it whole"""
+    lines: List[str] = []
+    for line in stream:
+        if INVENTORY_DELIMITER and line.strip() == INVENTORY_DELIMITER:
+            item = "".join(lines).strip()
+            if item:
+                yield item
+            lines = []
+        else:
+            lines.append(line)
+    item = "".join(lines).strip()
+    if item:
+        yield item
+
+def _has_delimiter(raw: bytes) -> bool:
+    if not INVENTORY_DELIMITER:
+        return False
+    delimiter = INVENTORY_DELIMITER.encode("utf-8")
+    return any(line.strip() == delimiter for line in raw.splitlines())
+
+def _source_items(stream: Iterator[str], read_raw: Callable[[], bytes]) -> Iterator[Union[str, bytes]]:
+    """Yields the content of each item to store; a file without delimiters is stored byte for byte"""
+    items = iter_items(stream)
+    first = next(items, None)
+    if first is None:
+        return
+    second = next(items, None)
+    if second is None:
+        raw = read_raw()
+        yield first if _has_delimiter(raw) else raw
+        return
+    yield from chain((first, second), items)
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def _iter_sources(path: str, filename: str, default_folder: Optional[str], folders: List[str]
+                  ) -> Iterator[Tuple[str, Optional[str], Iterator[str], Callable[[], bytes]]]:
+    """Yields (source name, folder, text stream, raw bytes reader) for a .txt upload or every .txt inside a zip"""
+    if not filename.endswith(".zip"):
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            yield filename, default_folder, f, lambda: _read_file(path)
+        return
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            member = info.filename
+            base = os.path.basename(member).lower()
+            if info.is_dir() or member.startswith("__MACOSX/") or not base.endswith(".txt"):
+                continue
+            # Папка из имени файла внутри архива важнее, чем из имени самого архива
+            folder = route_folder(member, folders) or default_folder
+            with zf.open(info) as raw:
+                yield (base, folder, io.TextIOWrapper(raw, encoding="utf-8", errors="replace"),
+                       lambda info=info: zf.read(info))
+
+def _flush(batch: List[Tuple[str, Union[str, bytes], bytes, str]], index: Dict[bytes, str]) -> None:
+    if not batch:
+        return
+    for path, content, _digest, _folder in batch:
+        if isinstance(content, bytes):
+            with open(path, "wb") as f:
+                f.write(content)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+    # Хеши попадают в индекс (в файл и в память) только после того, как товары легли на диск,
+    # иначе сбой посреди загрузки навсегда пометил бы незаписанные товары как дубликаты
+    with open(INVENTORY_INDEX_FILE, "a", encoding="utf-8") as f:
+        f.writelines(f"{digest.hex()} {folder}\n" for _path, _content, digest, folder in batch)
+    for _path, _content, digest, folder in batch:
+        index[digest] = folder
+    batch.clear()
+
+def ingest_upload(path: str, filename: str, default_folder: Optional[str],
+                  folders: List[str]) -> Dict[str, Any]:
+    """Splits an uploaded .txt/.zip into items and writes them to stock in batches.
+
+    Items whose content hash is already indexed (in stock or sold) are skipped.
+    Blocking: call it via asyncio.to_thread from handlers.
+    Returns {"counts": {folder: added}, "duplicates": {folder of original: skipped},
+    "skipped": [source names], "elapsed": seconds}.
+    """
+    started = time.perf_counter()
+    counts: Dict[str, int] = {}
+    duplicates: Dict[str, int] = {}
+    skipped: List[str] = []
+    batch: List[Tuple[str, Union[str, bytes], bytes, str]] = []
+    taken: Set[str] = set()
+    # Хеши этой загрузки, ещё не сброшенные на диск
+    seen: Dict[bytes, str] = {}
+    with _index_lock:
+        index = _load_index(folders)
+        for source, folder, stream, read_raw in _iter_sources(path, filename, default_folder, folders):
+            if folder is None:
+                skipped.append(source)
+                continue
+            stem = os.path.splitext(source)[0]
+            for content in _source_items(stream, read_raw):
+                digest = item_digest(content)
+                known = index.get(digest) or seen.get(digest)
+                if known is not None:
+                    duplicates[known] = duplicates.get(known, 0) + 1
+                    continue
+                seen[digest] = folder
+                # Имя файла сохраняем, пока оно свободно; иначе добавляем хеш, чтобы не затереть товар
+                item_path = f"data/{folder}/{source}"
+                if item_path in taken or os.path.exists(item_path):
+                    item_path = f"data/{folder}/{stem}_{digest.hex()[:12]}.txt"
+                taken.add(item_path)
+                batch.append((item_path, content, digest, folder))
+                counts[folder] = counts.get(folder, 0) + 1
+                if len(batch) >= INGEST_BATCH_SIZE:
+                    _flush(batch, index)
+        _flush(batch, index)
+    return {
+        "counts": counts,
+        "duplicates": duplicates,
+        "skipped": skipped,
+        "elapsed": time.perf_counter() - started,
+    }
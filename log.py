@@ -0,0 +1,66 @@
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from config import LOG_LEVEL, LOG_LEVELS
+
+# Атрибуты LogRecord, которые не попадают в JSON как поля события
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "sample"}
+
+_listener: Optional[QueueListener] = None
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg plus fields passed via extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SampleFilter(logging.Filter):
+    """Keeps only a share of records logged with extra={"sample": rate}"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, "sample", None)
+        return rate is None or random.random() < rate
+
+class _EnqueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Форматирование откладываем до фонового потока, в очередь кладём запись как есть
+        return record
+
+def setup_logging() -> None:
+    """Routes all logging through a queue; a background listener writes JSON lines to stdout"""
+    global _listener
+    if _listener is not None:
+        return
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    _listener = QueueListener(log_queue, stream_handler)
+
+    queue_handler = _EnqueueHandler(log_queue)
+    queue_handler.addFilter(SampleFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    for name, level in LOG_LEVELS.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -6,7 +6,11 @@ from aiogram.client.default import DefaultBotProperties
 
 from config import BOT_TOKEN
 from handlers import register_handlers
+from log import setup_logging
 from payments import check_invoices
+from rates import refresh_rates
+
+setup_logging()
 
 # Инициализация бота и диспетчера
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
@@ -20,6 +24,8 @@ if __name__ == "__main__":
     async def main():
         # Запускаем background task для проверки инвойсов
         asyncio.create_task(check_invoices(bot))
+        # Фоновое обновление курсов валют
+        asyncio.create_task(refresh_rates())
         # Запускаем polling
         await dp.start_polling(bot)
 
@@ -1,90 +1,213 @@
+import time
 import asyncio
+import logging
+import threading
 import requests
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from aiogram import Bot
-from config import CRYPTOBOT_API_TOKEN
+from config import CRYPTOBOT_API_TOKEN, CRYPTO_API_BASE
+from rates import convert_usd
+
+logger = logging.getLogger(__name__)
 
 CRYPTO_TOKEN = CRYPTOBOT_API_TOKEN
-CRYPTO_API_BASE = "https://pay.crypt.bot/api"
+DEFAULT_ASSET = "USDT"
+
+# Время жизни инвойса в CryptoBot (expires_in), секунд
+INVOICE_TTL = 3600
+# Повторно отдаём инвойс, только если ему осталось жить дольше этого
+INVOICE_REUSE_MARGIN = 300
+# Период опроса getInvoices, секунд
+INVOICE_POLL_INTERVAL = 10
+# Сколько инвойсов запрашивать за один вызов getInvoices (API отдаёт не больше 1000)
+INVOICE_POLL_BATCH = 100
+# Через сколько секунд после истечения перестаём отслеживать инвойс, если успешный опрос не показал его оплаченным
+INVOICE_EXPIRY_GRACE = 600
+
+# Таймаут HTTP-запросов к CryptoBot, секунд
+REQUEST_TIMEOUT = 10
 
 # Словарь активных инвойсов
 active_invoices: Dict[str, Dict[str, Any]] = {}
+# Неоплаченные инвойсы пользователя: user_id -> {(amount, asset): invoice_id}
+pending_by_user: Dict[int, Dict[Tuple[int, str], Any]] = {}
+_pending_lock = threading.Lock()
+
+def _forget_invoice(inv_id: Any) -> None:
+    """Stops tracking an invoice (paid, expired or deleted)"""
+    with _pending_lock:
+        invoice = active_invoices.pop(inv_id, None)
+        if invoice is None:
+            return
+        pending = pending_by_user.get(invoice["user_id"])
+        if pending and pending.get((invoice["amount"], invoice["asset"])) == inv_id:
+            del pending[(invoice["amount"], invoice["asset"])]
+            if not pending:
+                del pending_by_user[invoice["user_id"]]
+
+def _delete_invoice(inv_id: Any) -> None:
+    """Deletes an unpaid invoice; if CryptoBot refuses (e.g. it was just paid), keep tracking it"""
+    headers = {"Crypto-Pay-API-Token": CRYPTO_TOKEN}
+    try:
+        response = requests.post(f"{CRYPTO_API_BASE}/deleteInvoice", headers=headers, json={"invoice_id": inv_id},
+                                 timeout=REQUEST_TIMEOUT)
+        if response.json().get("ok"):
+            _forget_invoice(inv_id)
+    except Exception as e:
+        logger.warning("Invoice delete error: %s", e, extra={"invoice_id": inv_id})
+
+def create_crypto_invoice(user_id: int, amount: int, asset: str = DEFAULT_ASSET) -> Optional[str]:
+    """Создает инвойс в CryptoBot на amount$ в валюте asset или возвращает ещё действующий на ту же сумму"""
+    key = (amount, asset)
+    with _pending_lock:
+        pending = pending_by_user.get(user_id, {})
+        inv_id = pending.get(key)
+        invoice = active_invoices.get(inv_id) if inv_id is not None else None
+        if invoice and not invoice["paid"] and invoice["expires_at"] - time.time() > INVOICE_REUSE_MARGIN:
+            return invoice["pay_url"]
+        superseded = list(pending.values())
+
+    # Курс берётся только из кэша; если его нет, инвойс не создаём
+    asset_amount = convert_usd(amount, asset)
+    if asset_amount is None:
+        logger.warning("No exchange rate for %s", asset, extra={"user_id": user_id, "amount": amount})
+        return None
 
-def create_crypto_invoice(user_id: int, amount: int) -> Optional[str]:
-    """Создает инвойс в CryptoBot"""
     headers = {
         "Crypto-Pay-API-Token": CRYPTO_TOKEN
     }
     payload = {
-        "asset": "USDT",
-        "amount": amount,
+        "asset": asset,
+        "amount": str(asset_amount),
         "description": f"Top up balance by {amount}$",
         "hidden_message": "Thanks for your payment! Balance will be credited automatically.",
         "payload": f"{user_id}:{amount}",
-        "allow_comments": False
+        "allow_comments": False,
+        "expires_in": INVOICE_TTL
     }
     
     try:
-        response = requests.post(f"{CRYPTO_API_BASE}/createInvoice", headers=headers, json=payload)
+        response = requests.post(f"{CRYPTO_API_BASE}/createInvoice", headers=headers, json=payload,
+                                 timeout=REQUEST_TIMEOUT)
         data = response.json()
         
         if data.get("ok"):
             invoice = data["result"]
-            active_invoices[invoice["invoice_id"]] = {
-                "user_id": user_id,
-                "amount": amount,
-                "paid": False
-            }
+            with _pending_lock:
+                active_invoices[invoice["invoice_id"]] = {
+                    "user_id": user_id,
+                    "amount": amount,
+                    "asset": asset,
+                    "pay_url": invoice["pay_url"],
+                    "expires_at": time.time() + INVOICE_TTL,
+                    "paid": False
+                }
+                pending_by_user[user_id] = {key: invoice["invoice_id"]}
+            # У пользователя остаётся один ожидающий инвойс, прежние удаляем
+            if superseded:
+                _drop_superseded(superseded)
             return invoice["pay_url"]
     except Exception as e:
-        print(f"Invoice creation error: {e}")
+        logger.error("Invoice creation error: %s", e, extra={"user_id": user_id, "amount": amount})
     
     return None
 
+def _poll_invoices(invoice_ids: List[Any]) -> Optional[List[Dict[str, Any]]]:
+    """Fetches the given invoices via getInvoices (blocking); None on error"""
+    headers = {"Crypto-Pay-API-Token": CRYPTO_TOKEN}
+    # Без invoice_ids CryptoBot отдаёт только последние 100 инвойсов — старые оплаты терялись
+    params = {"invoice_ids": ",".join(str(i) for i in invoice_ids), "count": len(invoice_ids)}
+    try:
+        response = requests.get(f"{CRYPTO_API_BASE}/getInvoices", headers=headers, params=params,
+                                timeout=REQUEST_TIMEOUT)
+        data = response.json()
+    except Exception as e:
+        logger.warning("Invoice request error: %s", e)
+        return None
+
+    if not data.get("ok"):
+        return None
+        
+    result = data.get("result")
+    if not isinstance(result, dict) or "items" not in result:
+        logger.error("Unexpected result structure: %s", result)
+        return None
+
+    invoices = result["items"]
+    if not isinstance(invoices, list):
+        logger.error("Unexpected invoices type: %s, content: %s", type(invoices), invoices)
+        return None
+    return invoices
+
+def _drop_superseded(inv_ids: List[Any]) -> None:
+    """Deletes superseded invoices that are still active (blocking).
+
+    Statuses are fetched first: a paid invoice must not be deleted and forgotten,
+    so it stays tracked and check_invoices credits it on the next poll.
+    """
+    invoices = _poll_invoices(inv_ids)
+    if invoices is None:
+        # Статус неизвестен — ничего не удаляем, инвойсы остаются в отслеживании
+        return
+    for invoice in invoices:
+        if isinstance(invoice, dict) and invoice.get("status") == "active":
+            _delete_invoice(invoice.get("invoice_id"))
+
+def _credit_invoice(inv_id: Any) -> None:
+    """Credits a paid invoice to the user's balance and stops tracking it"""
+    from database import update_balance
+
+    invoice = active_invoices[inv_id]
+    update_balance(invoice["user_id"], invoice["amount"])
+    invoice["paid"] = True
+    logger.info("Invoice paid", extra={"invoice_id": inv_id, "user_id": invoice["user_id"], "amount": invoice["amount"]})
+    _forget_invoice(inv_id)
+
 async def check_invoices(bot: Bot) -> None:
     """Checks invoice status and credits funds"""
-    from database import update_balance
-    
     while True:
-        await asyncio.sleep(10)
+        await asyncio.sleep(INVOICE_POLL_INTERVAL)
         if not active_invoices:
             continue
 
-        headers = {"Crypto-Pay-API-Token": CRYPTO_TOKEN}
-        try:
-            response = requests.get(f"{CRYPTO_API_BASE}/getInvoices", headers=headers)
-            data = response.json()
-        except Exception as e:
-            print(f"Invoice request error: {e}")
-            continue
-
-        if not data.get("ok"):
-            continue
-            
-        result = data.get("result")
-        if not isinstance(result, dict) or "items" not in result:
-            print(f"Unexpected result structure: {result}")
-            continue
+        tracked = list(active_invoices)
+        for start in range(0, len(tracked), INVOICE_POLL_BATCH):
+            batch = tracked[start:start + INVOICE_POLL_BATCH]
+            invoices = await asyncio.to_thread(_poll_invoices, batch)
+            if invoices is None:
+                # Без ответа API ничего не забываем: оплату, сделанную перед истечением, зачислим после сбоя
+                continue
+            polled_at = time.time()
 
-        invoices = result["items"]
-        if not isinstance(invoices, list):
-            print(f"Unexpected invoices type: {type(invoices)}, content: {invoices}")
-            continue
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Invoices polled", extra={"tracked": len(active_invoices), "returned": len(invoices)})
 
-        for invoice in invoices:
-            if not isinstance(invoice, dict):
-                print(f"Unexpected invoice type: {type(invoice)}, content: {invoice}")
-                continue
+            for invoice in invoices:
+                if not isinstance(invoice, dict):
+                    logger.error("Unexpected invoice type: %s, content: %s", type(invoice), invoice)
+                    continue
 
-            if invoice.get("status") == "paid":
                 inv_id = invoice.get("invoice_id")
-                if inv_id in active_invoices and not active_invoices[inv_id]["paid"]:
-                    user_id = active_invoices[inv_id]["user_id"]
-                    amount = active_invoices[inv_id]["amount"]
-                    update_balance(user_id, amount)
-                    active_invoices[inv_id]["paid"] = True
-                    
-                    try:
-                        await bot.send_message(user_id, f"✅ Payment of {amount}$ received. Balance credited.")
-                    except Exception as e:
-                        print(f"Message send error: {e}")
+                if invoice.get("status") == "expired":
+                    _forget_invoice(inv_id)
+                elif invoice.get("status") == "paid":
+                    if inv_id in active_invoices and not active_invoices[inv_id]["paid"]:
+                        user_id = active_invoices[inv_id]["user_id"]
+                        amount = active_invoices[inv_id]["amount"]
+                        _credit_invoice(inv_id)
+                        
+                        try:
+                            await bot.send_message(user_id, f"✅ Payment of {amount}$ received. Balance credited.")
+                        except Exception as e:
+                            logger.warning("Message send error: %s", e, extra={"user_id": user_id})
+
+            # Успешный опрос после истечения и грейса не показал инвойс оплаченным (не вернул его
+            # или вернул активным) — оплатить его уже нельзя, перестаём отслеживать
+            for inv_id in batch:
+                invoice = active_invoices.get(inv_id)
+                if invoice is not None and invoice["expires_at"] + INVOICE_EXPIRY_GRACE < polled_at:
+                    logger.warning("Dropping unresolved invoice", extra={
+                        "invoice_id": inv_id, "user_id": invoice["user_id"],
+                        "amount": invoice["amount"], "asset": invoice["asset"],
+                    })
+                    _forget_invoice(inv_id)
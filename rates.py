@@ -0,0 +1,69 @@
+import time
+import asyncio
+import logging
+import requests
+from decimal import Decimal, ROUND_UP
+from typing import Dict, Optional
+
+from config import CRYPTOBOT_API_TOKEN, CRYPTO_API_BASE
+
+logger = logging.getLogger(__name__)
+
+CRYPTO_TOKEN = CRYPTOBOT_API_TOKEN
+
+# Как часто обновлять курсы, секунд
+RATE_TTL = 60
+# Старше этого курсы не используются: лучше отказать в оплате, чем выставить неверную сумму
+RATE_MAX_STALENESS = 600
+
+# Стейблкоины считаем 1:1 к доллару, как и раньше
+PEGGED_ASSETS = {"USDT": Decimal(1), "USDC": Decimal(1)}
+# Знаков после запятой в сумме инвойса
+ASSET_DECIMALS = {"USDT": 2, "USDC": 2, "TON": 4, "TRX": 2, "BTC": 8, "ETH": 6, "LTC": 6, "BNB": 6}
+
+# asset -> сколько USD стоит 1 единица; словарь подменяется целиком при обновлении
+_rates: Dict[str, Decimal] = {}
+_fetched_at = float("-inf")
+
+def fetch_rates() -> Dict[str, Decimal]:
+    """Loads asset->USD rates via getExchangeRates (blocking)"""
+    headers = {"Crypto-Pay-API-Token": CRYPTO_TOKEN}
+    response = requests.get(f"{CRYPTO_API_BASE}/getExchangeRates", headers=headers, timeout=10)
+    data = response.json()
+    if not data.get("ok"):
+        logger.warning("Exchange rates request failed: %s", data.get("error"))
+        return {}
+    rates: Dict[str, Decimal] = {}
+    for item in data.get("result", []):
+        if item.get("is_valid") and item.get("target") == "USD":
+            rates[item["source"]] = Decimal(item["rate"])
+    return rates
+
+def get_rate(asset: str) -> Optional[Decimal]:
+    """USD price of one unit of asset from the cache, or None if unknown or too stale"""
+    if asset in PEGGED_ASSETS:
+        return PEGGED_ASSETS[asset]
+    if time.monotonic() - _fetched_at > RATE_MAX_STALENESS:
+        return None
+    return _rates.get(asset)
+
+def convert_usd(amount: int, asset: str) -> Optional[Decimal]:
+    """Converts a dollar amount to asset units, rounded up to the asset precision"""
+    rate = get_rate(asset)
+    if not rate:
+        return None
+    quantum = Decimal(1).scaleb(-ASSET_DECIMALS.get(asset, 8))
+    return (Decimal(amount) / rate).quantize(quantum, rounding=ROUND_UP)
+
+async def refresh_rates() -> None:
+    """Keeps the rate cache fresh in the background"""
+    global _rates, _fetched_at
+    while True:
+        try:
+            rates = await asyncio.to_thread(fetch_rates)
+            if rates:
+                _rates = rates
+                _fetched_at = time.monotonic()
+        except Exception as e:
+            logger.warning("Exchange rates request error: %s", e)
+        await asyncio.sleep(RATE_TTL)
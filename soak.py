@@ -0,0 +1,217 @@
+"""Soak test of the payment pipeline against the local Crypto Pay stand-in.
+
+Drives thousands of top-ups through create_crypto_invoice and check_invoices,
+then checks that every paid invoice was credited exactly once and reports credit
+latency, API call counts and how the invoice tracking grew.
+
+    python soak.py --invoices 5000 --users 500 --latency 0.01 --error-rate 0.02
+
+Runs in a temporary directory, so users.json of the shop is not touched.
+Exit code is 1 if any paid invoice was credited zero or several times.
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+# Запуск из корня репозитория в отдельной рабочей папке
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import database
+import payments
+import rates
+from cryptopay_stub import CryptoPayStub
+
+AMOUNTS = [5, 10, 20, 25, 50, 100]
+
+class _Bot:
+    """Stands in for aiogram.Bot: check_invoices only sends notifications"""
+
+    def __init__(self) -> None:
+        self.sent = 0
+
+    async def send_message(self, user_id: int, text: str) -> None:
+        self.sent += 1
+
+def _record_credits(credits: List[Any]) -> None:
+    """Wraps payments._credit_invoice to collect invoice id and credit time"""
+    credit_invoice = payments._credit_invoice
+
+    def wrapper(inv_id: Any) -> None:
+        credit_invoice(inv_id)
+        credits.append((inv_id, time.time()))
+
+    payments._credit_invoice = wrapper
+
+def _start_webhook_receiver() -> ThreadingHTTPServer:
+    received = Counter()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            received["invoice_paid"] += 1
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.received = received
+    server.daemon_threads = True
+    asyncio.get_running_loop().run_in_executor(None, server.serve_forever)
+    return server
+
+def _deep_size(obj: Any) -> int:
+    """Approximate size in bytes of a structure of dicts, lists, tuples and scalars"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_size(k) + _deep_size(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_deep_size(item) for item in obj)
+    return size
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+async def run(args: argparse.Namespace) -> bool:
+    webhook = _start_webhook_receiver()
+    stub = CryptoPayStub(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, pay_rate=args.pay_rate,
+        pay_delay=(args.pay_min, args.pay_max), seed=args.seed,
+        webhook_url=f"http://127.0.0.1:{webhook.server_address[1]}/",
+    ).start()
+
+    # Направляем клиентов на стенд и ускоряем таймеры
+    for module in (payments, rates):
+        module.CRYPTO_API_BASE = stub.url
+        module.CRYPTO_TOKEN = stub.token
+    payments.INVOICE_TTL = args.ttl
+    payments.INVOICE_REUSE_MARGIN = args.ttl / 4
+    payments.INVOICE_POLL_INTERVAL = args.poll
+    payments.INVOICE_EXPIRY_GRACE = args.poll * 3
+
+    credits: List[Any] = []
+    _record_credits(credits)
+
+    bot = _Bot()
+    background = [asyncio.create_task(rates.refresh_rates()), asyncio.create_task(payments.check_invoices(bot))]
+    assets = [a.strip().upper() for a in args.assets.split(",") if a.strip()]
+    while any(rates.get_rate(a) is None for a in assets):
+        await asyncio.sleep(0.05)
+
+    samples = {"active": 0, "pending_users": 0, "bytes": 0}
+
+    async def sample() -> None:
+        while True:
+            samples["active"] = max(samples["active"], len(payments.active_invoices))
+            samples["pending_users"] = max(samples["pending_users"], len(payments.pending_by_user))
+            # Копии под блокировкой: create_crypto_invoice меняет словари из рабочих потоков
+            with payments._pending_lock:
+                tracking = (dict(payments.active_invoices), {k: dict(v) for k, v in payments.pending_by_user.items()})
+            samples["bytes"] = max(samples["bytes"], _deep_size(tracking))
+            await asyncio.sleep(0.05)
+
+    background.append(asyncio.create_task(sample()))
+
+    # Нагрузка детерминирована seed: кто, сколько и в какой валюте пополняет
+    rng = random.Random(args.seed)
+    workload = [(rng.randrange(args.users) + 1, rng.choice(AMOUNTS), rng.choice(assets)) for _ in range(args.invoices)]
+    outcome = Counter()
+    urls_seen = set()
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def top_up(user_id: int, amount: int, asset: str) -> None:
+        async with slots:
+            url = await asyncio.to_thread(payments.create_crypto_invoice, user_id, amount, asset)
+        if url is None:
+            outcome["failed"] += 1
+        elif url in urls_seen:
+            outcome["reused"] += 1
+        else:
+            urls_seen.add(url)
+            outcome["created"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(top_up(*request) for request in workload))
+    drive_time = time.perf_counter() - started
+
+    # Ждём, пока все инвойсы оплатятся или истекут и трекинг опустеет
+    deadline = time.monotonic() + args.ttl + args.poll * 5 + args.drain_timeout
+    while (stub.count("active") or payments.active_invoices) and time.monotonic() < deadline:
+        await asyncio.sleep(args.poll)
+    await asyncio.sleep(args.poll * 2)
+    for task in background:
+        task.cancel()
+    stub.stop()
+    webhook.shutdown()
+
+    # ---------- проверки ----------
+    paid = {inv_id: inv for inv_id, inv in stub.invoices.items() if inv["status"] == "paid"}
+    credited = Counter(inv_id for inv_id, _ts in credits)
+    duplicates = [inv_id for inv_id, n in credited.items() if n > 1]
+    missing = [inv_id for inv_id in paid if inv_id not in credited]
+    unexpected = [inv_id for inv_id in credited if inv_id not in paid]
+    latencies = [ts - paid[inv_id]["_paid_ts"] for inv_id, ts in credits if inv_id in paid]
+
+    expected_balance: Dict[int, int] = defaultdict(int)
+    for inv in paid.values():
+        user_id, amount = inv["payload"].split(":")
+        expected_balance[int(user_id)] += int(amount)
+    users = database.load_users()
+    balance_mismatch = [uid for uid, amount in expected_balance.items()
+                        if users.get(str(uid), {}).get("balance", 0) != amount]
+
+    statuses = Counter(inv["status"] for inv in stub.invoices.values())
+    print(f"Top-up requests: {len(workload)} in {drive_time:.1f}s "
+          f"(created {outcome['created']}, reused {outcome['reused']}, failed {outcome['failed']})")
+    print("Invoices at stand-in: " + ", ".join(f"{k} {v}" for k, v in sorted(statuses.items())))
+    print("API calls: " + ", ".join(f"{k} {v}" for k, v in sorted(stub.calls.items()))
+          + f"; injected errors {sum(stub.errors.values())}; deletes of non-active invoices: "
+          + (", ".join(f"{k} {v}" for k, v in sorted(stub.refused_deletes.items())) or "none"))
+    print(f"Webhooks: sent {stub.webhooks['sent']}, failed {stub.webhooks['failed']}, "
+          f"received {webhook.received['invoice_paid']}")
+    print(f"Credit latency: p50 {_percentile(latencies, 0.5):.2f}s, p95 {_percentile(latencies, 0.95):.2f}s, "
+          f"max {max(latencies, default=0.0):.2f}s")
+    print(f"Invoice tracking: peak {samples['active']} invoices / {samples['pending_users']} users, "
+          f"final {len(payments.active_invoices)} / {len(payments.pending_by_user)}, "
+          f"peak size {samples['bytes'] / 1024:.0f} KiB")
+    print(f"Credits: {sum(credited.values())} for {len(paid)} paid invoices; duplicates {len(duplicates)}, "
+          f"missing {len(missing)}, unexpected {len(unexpected)}, balance mismatches {len(balance_mismatch)}")
+
+    ok = not (duplicates or missing or unexpected or balance_mismatch)
+    print("OK: every paid invoice credited exactly once" if ok else "FAIL")
+    return ok
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invoices", type=int, default=2000, help="top-up requests to send")
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--assets", default="USDT,TON,BTC")
+    parser.add_argument("--concurrency", type=int, default=16, help="parallel create_crypto_invoice calls")
+    parser.add_argument("--latency", type=float, default=0.005, help="stand-in latency per request, s")
+    parser.add_argument("--jitter", type=float, default=0.003)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--pay-rate", type=float, default=0.7, help="share of invoices that get paid")
+    parser.add_argument("--pay-min", type=float, default=0.2, help="min seconds from creation to payment")
+    parser.add_argument("--pay-max", type=float, default=4.0)
+    parser.add_argument("--ttl", type=float, default=6.0, help="invoice expires_in, s")
+    parser.add_argument("--poll", type=float, default=0.5, help="check_invoices poll interval, s")
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="soak-"))
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import time
+import asyncio
+import logging
+from math import ceil
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from config import ADMIN_IDS, LOG_SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+# Лимиты по классам обработчиков (класс задаётся флагом throttle при регистрации):
+# rate — токенов в секунду на пользователя, burst — ёмкость корзины,
+# concurrency — сколько обработчиков класса выполняется одновременно,
+# queue_timeout — сколько секунд запрос ждёт свободного слота, прежде чем будет сброшен
+THROTTLE_LIMITS: Dict[str, Dict[str, float]] = {
+    "invoice": {"rate": 1 / 20, "burst": 3, "concurrency": 4, "queue_timeout": 5.0},
+    "purchase": {"rate": 1 / 2, "burst": 5, "concurrency": 8, "queue_timeout": 5.0},
+    # /start и проверка подписки: перезапись users.json и вызов get_chat_member
+    "start": {"rate": 1 / 10, "burst": 3, "concurrency": 8, "queue_timeout": 2.0},
+    "menu": {"rate": 2.0, "burst": 10, "concurrency": 32, "queue_timeout": 2.0},
+}
+DEFAULT_THROTTLE_CLASS = "menu"
+
+# Как часто (в событиях) выбрасывать заполненные корзины
+PRUNE_EVERY = 1000
+
+async def _notify(event: TelegramObject, text: str) -> None:
+    try:
+        if isinstance(event, CallbackQuery):
+            await event.answer(text)
+        elif isinstance(event, Message):
+            await event.answer(text)
+    except Exception:
+        pass
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Per-user token buckets for each handler class plus a per-class concurrency cap.
+
+    Must be registered as an inner middleware so handler flags are visible.
+    Admins are never throttled.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, float]]] = None):
+        self.limits = limits or THROTTLE_LIMITS
+        # (class, user_id) -> [tokens, updated_at, notified_until]
+        self.buckets: Dict[Tuple[str, int], List[float]] = {}
+        self.slots = {name: asyncio.Semaphore(int(spec["concurrency"])) for name, spec in self.limits.items()}
+        self.events = 0
+
+    def _take(self, key: Tuple[str, int], spec: Dict[str, float], now: float) -> float:
+        """Takes a token; returns 0 on success, otherwise seconds until the next token"""
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [float(spec["burst"]), now, 0.0]
+        else:
+            bucket[0] = min(spec["burst"], bucket[0] + (now - bucket[1]) * spec["rate"])
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / spec["rate"]
+
+    def _prune(self, now: float) -> None:
+        # Полная корзина ничем не отличается от отсутствующей
+        def is_idle(key: Tuple[str, int], bucket: List[float]) -> bool:
+            spec = self.limits[key[0]]
+            return bucket[0] + (now - bucket[1]) * spec["rate"] >= spec["burst"] and bucket[2] <= now
+        self.buckets = {key: b for key, b in self.buckets.items() if not is_idle(key, b)}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or user.id in ADMIN_IDS:
+            return await handler(event, data)
+
+        name = get_flag(data, "throttle", default=DEFAULT_THROTTLE_CLASS)
+        spec = self.limits[name]
+        now = time.monotonic()
+        self.events += 1
+        if self.events % PRUNE_EVERY == 0:
+            self._prune(now)
+
+        key = (name, user.id)
+        wait = self._take(key, spec, now)
+        if wait:
+            logger.info("Throttled", extra={"user_id": user.id, "throttle": name, "sample": LOG_SAMPLE_RATE})
+            bucket = self.buckets[key]
+            # Одно предупреждение на период ожидания, дальше молча отбрасываем
+            if bucket[2] <= now:
+                bucket[2] = now + wait
+                await _notify(event, f"⏳ Too many requests. Try again in {ceil(wait)}s.")
+            elif isinstance(event, CallbackQuery):
+                # Пустой ответ убирает «часики» на кнопке
+                try:
+                    await event.answer()
+                except Exception:
+                    pass
+            return None
+
+        # Перегрузка: ждём слот не дольше queue_timeout, иначе сбрасываем запрос
+        slot = self.slots[name]
+        try:
+            await asyncio.wait_for(slot.acquire(), spec["queue_timeout"])
+        except asyncio.TimeoutError:
+            logger.warning("Shed", extra={"user_id": user.id, "throttle": name, "sample": LOG_SAMPLE_RATE})
+            await _notify(event, "⏳ The shop is busy right now. Please try again in a minute.")
+            return None
+        try:
+            return await handler(event, data)
+        finally:
+            slot.release()